@@ -21,43 +21,48 @@ def makegram(grammar):
 
         Returns:
             Stores rules in dictionary in which the key is the *output* of
-            the rule and the value is the input.
-                eg: ["book"]:["NN", "VB"]
-                    [NP]:["DET NN"]
+            the rule and the value is the input. Binary rules are keyed
+            by a tuple of the two righthand symbols.
+                eg: ["book"]:("NN", "VB")
+                    [("DET", "NN")]:("NP",)
     '''
-    grammar = open(grammar, encoding='utf-8')
-    grammar = grammar.read()
-
-    grammar = grammar.split('\n') # Splits into list of rules
-    del(grammar[-1]) # File ends in blank line. Don't need.
-    grammar = [rule.split(' -> ') for rule in grammar] # Splits rules into [lefthand string, righthand string]
-
     gram_dict = {}
-    for rule in grammar:
-        left = rule[0] # Lefthand side of rule
-        right = rule[1].strip('"') # Righthand side of rule, with quotes removed around terminal symbols
-        if right not in gram_dict:
-            gram_dict[right] =[left]
-        else:
-            gram_dict[right] += [left]
+    with open(grammar, encoding='utf-8') as rules:
+        for rule in rules:
+            if not rule.strip(): # Skips blank lines, eg: at the end of the file
+                continue
+            left, _, right = rule.rstrip('\n').partition(' -> ') # Lefthand and righthand sides of rule
+            if right.startswith('"'):
+                right = right.strip('"') # Terminal symbol, with quotes removed
+            elif len(right.split()) == 2:
+                right = tuple(right.split()) # Binary rule, eg: ("DET", "NN")
+            if right not in gram_dict:
+                gram_dict[right] =[left]
+            else:
+                gram_dict[right] += [left]
+    # Shared between calls, so immutable. Repeated rules are dropped.
+    gram_dict = {right: tuple(dict.fromkeys(lefts)) for right, lefts in gram_dict.items()}
     return gram_dict
 
 
+grammar_cache = {} # Grammars from makegram(), keyed by filename
+
+
 def makechart(length):
     '''Initializes a CKY table, with keys as tuples (i,k)
-       and all values as empty lists. Note: Starts at 1, not 0.
+       and all values as empty dictionaries. Note: Starts at 1, not 0.
 
        Args:
            Length of chart (Number of tokens in sentence)
 
        Returns:
-           Dictionary with values as empty lists
-           eg: (1,2):[]
+           Dictionary with values as empty dictionaries
+           eg: (1,2):{}
     '''
     chart = {}
     for i in range(1, length+1): # i represents the horizontal rows
         for k in range(i+1, length+2): # k represents the vertical columns
-            chart[(i,k)] = []
+            chart[(i,k)] = {}
     return chart
 
 
@@ -66,18 +71,25 @@ def cky(words, grammar):
 
        Args:
            words: A string of words
-           grammar: Grammar provided from makegram() function
+           grammar: Grammar provided from makegram() function, or the
+              filename of one, which is only read and parsed the first time
 
        Returns:
            chart: Chart from makechart() function filled out with
-              backpointers. If a word not in the grammar is encountered,
+              backpointers. Each cell maps a lefthand rule to its list of
+              backpointers, either the wordform or a tuple (j,B,C).
+                  eg: (1,3):{"NP": [(2, "DET", "NN")]}
+              If a word not in the grammar is encountered,
               returns the mostly/completely empty chart.
 
     '''
     words = words.split()
     length = len(words)
     chart = makechart(length)
-    grammar = makegram(grammar)
+    if isinstance(grammar, str):
+        if grammar not in grammar_cache:
+            grammar_cache[grammar] = makegram(grammar)
+        grammar = grammar_cache[grammar]
 
     # Outermost layer, nonterminal symbols only
     for i in range(1, length+1):
@@ -90,9 +102,9 @@ def cky(words, grammar):
             print("\tThe word '%s' is not in grammar!" % (word))
             return chart
 
-        rules = [[rule, word] for rule in rules] # Adds wordform as second element
-        # Add to chart. This functions as the backpointer termination condition.
-        chart[(i, i+1)] += rules
+        # Add wordform to chart. This functions as the backpointer termination condition.
+        for rule in rules:
+            chart[(i, i+1)][rule] = [word]
 
     #Moving through higher layers of chart
     for b in range(2, length+1): # b represents the width
@@ -100,17 +112,15 @@ def cky(words, grammar):
             for k in range(1, b):
                 rulesB = chart[(i, i+k)]
                 rulesC = chart[(i+k, i+b)]
+                cell = chart[(i,i+b)]
 
-                for B in rulesB: # There could be more than one rule for B or C (or none)
-                    for C in rulesC:
-                        justB = B[0] # To exclude backpointer element
-                        justC = C[0]
-                        BC = justB+" "+justC
+                for justB in rulesB: # There could be more than one rule for B or C (or none)
+                    for justC in rulesC:
+                        BC = (justB, justC)
                         if BC in grammar:
-                            A = grammar[BC]
                             # Adds backpointer value, equal to i+k
-                            A = [[rule, (i+k,justB,justC)] for rule in A]
-                            chart[(i,i+b)] += A
+                            for rule in grammar[BC]:
+                                cell.setdefault(rule, []).append((i+k,justB,justC))
     return chart
 
 
@@ -126,33 +136,85 @@ def backpointer(i,k,A,chart):
        Returns:
            trees: List of all parse trees in nltk.tree format
     '''
-    parses= chart[(i,k)] # Grabs possibilities for given location
-    options = set([(parse[0],parse[1]) for parse in parses]) # Remove doubles
-    options = [choice for choice in options if choice[0] == A] # Removes parses with wrong parent
+    return [to_tree(tree) for tree in tree_tuples(i,k,A,chart)]
+
+
+def tree_tuples(i,k,A,chart,memo=None):
+    '''Same as backpointer(), with trees as nested tuples instead of nltk trees.
+       Each (i,k,A) is only expanded once, and its subtrees are shared by every
+       parent that uses them.
+
+       Args:
+           i, k, A, chart: As in backpointer()
+           memo: Dictionary of subtrees already found, keyed by (i,k,A)
+
+       Returns:
+           trees: List of parse trees as (lefthand rule, children) tuples
+               eg: ("NP", (("DET", ("the",)), ("NN", ("flight",))))
+    '''
+    if memo is None:
+        memo = {}
+    if (i,k,A) in memo:
+        return memo[(i,k,A)]
+
+    options = chart[(i,k)].get(A, []) # Grabs possibilities for given location and parent
     trees = []
 
     for parse in options: #Iterate over possible tree parents
-        if type(parse[1]) != str: # For nonterminal branches
-            A,(j,B,C) = parse #Instantiate necessary variables at once
+        if type(parse) != str: # For nonterminal branches
+            j,B,C = parse #Instantiate necessary variables at once
 
             #Recurse over both respective child nodes
             #Returned as list of possible sub-trees
-            B_trees = backpointer(i,j,B,chart)
-            C_trees = backpointer(j,k,C,chart)
+            B_trees = tree_tuples(i,j,B,chart,memo)
+            C_trees = tree_tuples(j,k,C,chart,memo)
 
             #For all possible combinations of sub-trees
             for b in B_trees:
                 for c in C_trees:
-                    tree = Tree(A,[b,c])
-                    trees += [tree]
+                    trees.append((A, (b,c)))
 
         else: # For terminal branches
-            terminal_tree = Tree(A,[parse[1]])
-            trees += [terminal_tree]
+            trees.append((A, (parse,)))
 
+    memo[(i,k,A)] = trees
     return trees
 
 
+def to_tree(tree):
+    '''Converts a tree from tree_tuples() to nltk.tree format'''
+    A, children = tree
+    return Tree(A, [child if type(child) == str else to_tree(child) for child in children])
+
+
+def count_trees(i,k,A,chart,counts=None):
+    '''Counts the parse trees backpointer() would generate, without building them.
+       Each cell and lefthand rule is only counted once, as in the inside algorithm.
+
+       Args:
+           i, k, A, chart: As in backpointer()
+           counts: Dictionary of counts already found, keyed by (i,k,A)
+
+       Returns:
+           Number of possible parse trees
+    '''
+    if counts is None:
+        counts = {}
+    if (i,k,A) in counts:
+        return counts[(i,k,A)]
+
+    total = 0
+    for parse in chart[(i,k)].get(A, []):
+        if type(parse) != str: # For nonterminal branches
+            j,B,C = parse
+            total += count_trees(i,j,B,chart,counts) * count_trees(j,k,C,chart,counts)
+        else: # For terminal branches
+            total += 1
+
+    counts[(i,k,A)] = total
+    return total
+
+
 def recognizer(text):
     """Recognizes whether a string contitutes a sentence.
 
@@ -163,11 +225,7 @@ def recognizer(text):
     """
     length = len(text.split())
     chart = cky(text, gram) #Makes new chart based on the input
-    trees = backpointer(1, length+1, "SIGMA", chart)
-    if len(trees) > 0:
-        return True
-    else:
-        return False
+    return "SIGMA" in chart[(1, length+1)]
 
 
 def number_of_parses(input_filename, output_filename):
@@ -175,31 +233,28 @@ def number_of_parses(input_filename, output_filename):
        sentence and saves a text file with the original sentences
        and the number of parses for each.
     """
-    sentences = open(input_filename, encoding='utf-8')
-    sentences = sentences.read()
+    with open(input_filename, encoding='utf-8') as sentences:
+        sentences = sentences.read()
     sentences = sentences.split('\n') # Splits each line
     del(sentences[-1]) # Raw text ends in blank line.
     sentences = sentences[:15]
 
     number_of_sentences = len(sentences)
-    current_s = 1
-    new_text = '' #This will eventually be saved as the new file
+    lines = [] #This will eventually be saved as the new file
 
-    for sent in sentences:
+    for current_s, sent in enumerate(sentences, 1):
         #Display an update
         print("Processing sentence %d out of %d..." % (current_s, number_of_sentences))
         length = len(sent.split())
         chart = cky(sent, gram) #Make new chart for each sentence
-        trees = backpointer(1, length+1, "SIGMA", chart) #Rewinds through the backpointers to list trees
+        trees = count_trees(1, length+1, "SIGMA", chart) #Counts trees without listing them
 
-        new_text += sent
-        new_text += "\t%d\n" % (len(trees))
+        lines.append("%s\t%d\n" % (sent, trees))
 
     print("\nComplete")
 
-    new_file = open(output_filename, "w", encoding='utf-8')
-    new_file.write(new_text)
-    new_file.close()
+    with open(output_filename, "w", encoding='utf-8') as new_file:
+        new_file.writelines(lines)
 
     print(output_filename, "has been saved to your directory.")
 
@@ -211,12 +266,12 @@ def draw_nice(trees_to_draw, maxdraw=5):
     """
     length = len(trees_to_draw.split())
     chart = cky(trees_to_draw, gram)
-    trees = backpointer(1,length+1,"SIGMA",chart)
+    trees = tree_tuples(1,length+1,"SIGMA",chart)
     if len(trees) > maxdraw:
         print("Warning, large number of parses.")
         print("Only showing first %d trees." % (maxdraw))
     for t in trees[:maxdraw]:
-        draw_trees(t)
+        draw_trees(to_tree(t)) # Only the drawn trees are converted to nltk format
 
 
 gram = 'atis-grammar-cnf.cfg'
@@ -25,7 +25,7 @@ eg: synonymous with permit (v) and rhymes with "hate" --> "tolerate"
     synonymous with permit (n) and rhymes with "hate" --> ∅"""
 
 import nltk
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import re #regular expressions
 
 #synonym corpus
@@ -40,18 +40,37 @@ dictionary = defaultdict(list)
 for x in entries:
     dictionary[x[0]].append(x[1])
 
+STRESS = re.compile(r"[012]") #stress markers on vowel phonemes
+NOT_VOWELS = "BCDFGHJKLMNPQRSTVWXYZ" #letters that are not vowels in phoneme symbols
+PUNCTUATION = "!?\"',." #basic punctuation stripped from the ends of words
+
+def memoize(function):
+    """caches results of a function called repeatedly with the same arguments
+    (functools.lru_cache is not available in Python 2.7)
+    list arguments are stored as tuples so they can be used as keys"""
+    cache = {}
+    def memoized(*args):
+        key = tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+        if key not in cache:
+            cache[key] = function(*args)
+        return cache[key]
+    return memoized
+
 ###
 
+@memoize
 def basic_rime(pronunciation):
     """returns the rime of the final syllable of a *single* pronunciation as a list
     basic_rime([u'P', u'AY1', u'TH', u'AA0', u'N']) --> u'AAN' """
-    destressed = [phoneme.strip(r"[012]") for phoneme in pronunciation] #removes stress
-    pronunciation = "".join(destressed) #combines phonemes into one string
-    final_vowel = re.findall(r'[AEIOU]+', pronunciation)[-1] #determines final vowel in word
-    location = pronunciation.rindex(final_vowel) #determines location of final vowel
+    pronunciation = STRESS.sub("", "".join(pronunciation)) #combines phonemes into one string without stress
+    end = len(pronunciation.rstrip(NOT_VOWELS)) #determines end of final vowel in word
+    if end == 0:
+        raise IndexError("no vowel in pronunciation %r" % pronunciation)
+    location = len(pronunciation[:end].rstrip("AEIOU")) #determines location of final vowel
     basic_rime = pronunciation[location:]
     return basic_rime
 
+@memoize
 def rime(word):
     """for words with multiple possible pronunciations,
     returns the rime of all pronunciations as a string
@@ -62,6 +81,25 @@ def rime(word):
         rimes += [[basic_rime(pronunciation)] for pronunciation in word]
     return rimes
 
+#inverted index from each rime in the dictionary to the words that have it
+#rime_to_words[u'AWT'] --> set([u'about', u'route', u'stout', ...])
+rime_to_words = defaultdict(set)
+for word, pronunciations in dictionary.items():
+    for pronunciation in pronunciations:
+        try:
+            rime_to_words[basic_rime(pronunciation)].add(word)
+        except IndexError: #pronunciations with no vowel have no rime
+            pass
+
+@memoize
+def rhyming_words(word):
+    """returns all words in the dictionary that share a rime with any pronunciation of word
+    rhyming_words("route") --> set([u'about', u'astute', u'route', u'stout', ...])"""
+    rhymes = set()
+    for word_rime in rime(word):
+        rhymes |= rime_to_words.get(word_rime[0], set())
+    return rhymes
+
 ###
 
 def tag(sent):
@@ -85,6 +123,7 @@ def check_pos(tagged_word):
     elif pos == "J":
         return "a"
 
+@memoize
 def tagged_thesaurus(tagged_word):
     """returns synonyms of a word of the same POS
     tagged_thesaurus(('slow', 'VBN')) --> [u'decelerate', u'slow', u'slow_down', ... ]
@@ -97,9 +136,8 @@ def tagged_thesaurus(tagged_word):
         if syn_pos == "s":
             syn_pos = "a"
         if pos == syn_pos:
-            synonym_set = meaning.lemma_names()
-            [synonym_list.append(syn) for syn in synonym_set if syn not in synonym_list]
-    return synonym_list
+            synonym_list += meaning.lemma_names()
+    return list(OrderedDict.fromkeys(synonym_list)) #removes repeats, keeping the first of each
 
 ###
 
@@ -117,17 +155,21 @@ def tagged_rhyme_and_relate(rhyme, tagged_relate):
     """finds words that rhyme with word A and are also synonymous with word B and have same POS
     tagged_rhyme_and_relate(("route", "NN"), "sturdy") --> [u'stout']"""
     synonyms = tagged_thesaurus(tagged_relate)
+    rhymes = rhyming_words(rhyme.lower())
     return [word for word in synonyms if
-            check_rhyme(rhyme.lower(), word) and word.lower() != rhyme and word.lower() !=tagged_relate[0]]
+            word.lower() in rhymes and word.lower() != rhyme and word.lower() !=tagged_relate[0]]
 
 ###
 
 def find(rhyme, text):
     """searches a given text for words that have synonyms rhyming with a given word, returning a list of tuples
      find("head", "The sun was crimson.") --> ... [('head', 'crimson', [u'red'])] ..."""
-    text = tag(text)
+    return find_tagged(rhyme, tag(text))
+
+def find_tagged(rhyme, tagged_text):
+    """same as find, for a text already tagged by tag()"""
     words = []
-    for tagged_word in text:
+    for tagged_word in tagged_text:
         one_set = tagged_rhyme_and_relate(rhyme, tagged_word)
         if len(one_set) > 0:
             if rhyme != tagged_word[0]:
@@ -137,11 +179,11 @@ def find(rhyme, text):
 def full_find(text):
     """searches a text for words that have synonyms rhyming with other words in the text
     full_find("Upon his head, every hair was crimson.") --> ('head', 'crimson', [u'red'])  *among others"""
-    split_text = re.split(" ", text) #splits into words.
-    split_text = [word.strip(r"!?\"\',.") for word in split_text] #removes basic punctuation
+    split_text = [word.strip(PUNCTUATION) for word in text.split()] #splits into words and removes basic punctuation
+    tagged_text = tag(text) #tagged once and shared by every rhyme word
     all_words = []
     for rhyme in split_text:
-        all_words += find(rhyme, text)
+        all_words += find_tagged(rhyme, tagged_text)
     return all_words
 
 ###
@@ -17,290 +17,548 @@ corpus, over 90% accuracy assigning parts of speech.
 
 import collections
 from collections import Counter
-import math
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
 
 
 training_file = 'de-train.tt' #tagged data for training
 test_file = 'de-test.t' #untagged data for testing
 
 
+def iter_tagged(training_file):
+    '''Reads a tagged training corpus line by line,
+    yielding (obs, tag) tuples, and None for the blank
+    lines between sentences'''
+    with open(training_file, encoding='utf-8') as training_text:
+        for line in training_text:
+            line = line.split() #eg: ['Sehr', 'ADV']
+            if line:
+                yield tuple(map(sys.intern, line))
+                #Interned, so repeated words and tags share one string with a cached hash
+            else:
+                yield None
+
+
 def process_train(training_file):
     '''Reads a tagged training corpus,
     outputs the observations, tags, and
     tuples of (obs, tag)'''
-    training_text = open(training_file, encoding='utf-8')
-    training_text = training_text.read()
-    
-    training_sents = training_text.split('\n\n')
-    #Separates by sentences (which have a blank line between them in this data)
+    training_obs = [] #eg: ['Sehr', 'gute', 'Beratung',]
+    training_tags = [] #eg: ['ADV', 'ADJ', 'NOUN']
+    training_tagged = [] #eg: [('Sehr', 'ADV'), ('gute', 'ADJ'), ('Beratung', 'NOUN')]
     training_sent_init = []
-    for sent in training_sents:
-        sent = sent.split()
-        init_pos = sent[1:2] #Skips the initial wordform and takes the sentence-initial tag
-        training_sent_init += init_pos   
-    
-    training_text = training_text.split()
-    #eg: ['Sehr', 'ADV', 'gute', 'ADJ', 'Beratung', 'NOUN']
-    training_obs = training_text[::2] #even-numbered entries, eg: ['Sehr', 'gute', 'Beratung',]
-    training_tags = training_text[1::2] #odd-numbered entries, eg: ['ADV', 'ADJ', 'NOUN']
-    training_tagged = [(training_obs[x], training_tags[x]) for x in range(len(training_obs))]
-    #eg: [('Sehr', 'ADV'), ('gute', 'ADJ'), ('Beratung', 'NOUN')]
-    
+
+    sent_start = True
+    for tagged in iter_tagged(training_file):
+        if tagged is None: #Sentences have a blank line between them in this data
+            sent_start = True
+            continue
+        word, tag = tagged
+        training_obs.append(word)
+        training_tags.append(tag)
+        training_tagged.append(tagged)
+        if sent_start:
+            training_sent_init.append(tag) #Sentence-initial tag
+            sent_start = False
+
     return training_obs, training_tags, training_tagged, training_sent_init
 
 
 def process_test(test_file):
     '''Reads an untagged test file, outputs
-    the observations broken up by words'''
+    the observations broken up by sentences and words'''
     test = open(test_file, encoding='utf-8')
     test = test.read()
-    test_obs = test.split() #Separates by words
-    return test_obs
+    test = test.split('\n\n') #Sentences are split up by an empty line in this format
+    test_sents = [[sys.intern(w) for w in sentence.split()] for sentence in test] #Separates by words
+    return test_sents
 
 
-training_data = process_train(training_file)
-training_obs = training_data[0] #even-numbered entries, eg: ['Sehr', 'gute', 'Beratung',]
-training_tags = training_data[1]  #odd-numbered entries, eg: ['ADV', 'ADJ', 'NOUN']
-training_tagged = training_data[2] #eg: [('Sehr', 'ADV'), ('gute', 'ADJ'), ('Beratung', 'NOUN')]
-training_sent_init = training_data[3]
+test_sents = process_test(test_file)
 
-pos = set(training_tags)
 
-test_obs = process_test(test_file)
 
-test_vocab = set(test_obs)
-training_vocab = set(training_obs)
+###Module 2- Training Procedure###
 
 
-###Module 2- Training Procedure###
+def build_tag_index(pos):
+    '''Assigns each POS a row in the probability tables.
+    Reverse sorted so that argmax breaks ties like max()
+    over (prob, tag) tuples'''
+    return {tag: i for i, tag in enumerate(sorted(pos, reverse=True))}
+
+
+def build_vocab_index(words):
+    '''Assigns each word a column in the emission tables'''
+    return {word: i for i, word in enumerate(sorted(set(words)))}
+
 
+def log_prob(probs):
+    '''Converts an array of probabilities to natural logs. The base
+    does not matter for the tagger, since scaling every log probability
+    by the same factor leaves the best path unchanged'''
+    logs = np.full(probs.shape, float('-inf')) #To avoid a log(0) error
+    np.log(probs, out=logs, where=probs > 0)
+    return logs
 
-def find_init_prob(training_sent_init, pos):
+
+def find_init_prob(training_sent_init, tag2idx):
     '''From the training data, calculates
     the log of the initial probabilities'''
     count = collections.Counter(training_sent_init) 
     #Gets count of each POS. Equivalent to using FreqDist
 
-    init_probs = {p: count[p]/len(training_sent_init) for p in pos} 
+    init_probs = np.zeros(len(tag2idx))
+    for tag in count:
+        init_probs[tag2idx[tag]] = count[tag]
+    init_probs /= len(training_sent_init)
     #Calculates initial probabilities
     #len(training_sent_init) is equivalent to the number of sentences
 
-    #Convert probabilities to log base 2
-    for tag in init_probs:
-        if init_probs[tag] != 0:
-            init_probs[tag] = math.log2(init_probs[tag])
-        else:
-            init_probs[tag] = float('-inf') #To avoid a log(0) error
-
-    return init_probs
+    return log_prob(init_probs)
 
 
-def empty_dic(states):
-    dic = {p : 0 for p in pos}
-    return dic
-
-
-def find_trans_prob(training_tags, pos):
+def find_trans_prob(training_tags, tag2idx):
     '''From the training data, calculates
     the log of the transition probabilities'''
-    total_count = collections.Counter(training_tags)
+    N = len(tag2idx)
+    total_count = np.zeros(N)
+    for tag, count in Counter(training_tags).items():
+        total_count[tag2idx[tag]] = count
     #Count of each POS in training data
-    
-    pos_counts = empty_dic(pos)
-    for tag in pos:
-        pos_counts[tag]=empty_dic(pos)
-
-    for x in range(len(training_tags)-1):
-        pos_counts[training_tags[x]][training_tags[x+1]] += 1 
-        #Increments the count for each transition combination encountered
-
-    for tag in pos_counts:
-        for word in pos_counts[tag]:
-            pos_counts[tag][word] /= total_count[tag] 
-            #Divide by total count for each POS to get the probability
-            if pos_counts[tag][word] != 0:
-                pos_counts[tag][word] = math.log2(pos_counts[tag][word])
-                #Convert to log
-            else:
-                pos_counts[tag][word] = float('-inf')
-    
-    return pos_counts
 
+    trans = np.zeros((N, N))
+    for (tag, next_tag), count in Counter(zip(training_tags, training_tags[1:])).items():
+        trans[tag2idx[tag], tag2idx[next_tag]] = count
+    #Count of each transition combination encountered
 
-def find_emis_prob(training_tagged, pos):
-    '''From the training data, calculates
-    the log of the emission probabilities'''
-    pos_counts = {p : {} for p in pos}
+    trans /= total_count[:, None]
+    #Divide by total count for each POS to get the probability
 
-    #Count number of each word for each POS
-    for (word, tag) in training_tagged:
-        if word not in pos_counts[tag]:
-            pos_counts[tag].update({word: 1})
-        else:
-            pos_counts[tag][word] += 1
-
-    #Count the total number of each POS
-    total_count = collections.Counter(pos_counts)
-    total_count = {tag:sum(total_count[tag].values()) for tag in pos}
-
-    for tag in pos_counts:
-        for word in pos_counts[tag]:
-            pos_counts[tag][word] /= total_count[tag]
-            #Divide by total count for each emission to get the probability
-            if pos_counts[tag][word] != 0:
-                pos_counts[tag][word] = math.log2(pos_counts[tag][word]) 
-            else:
-                pos_counts[tag][word] = float('-inf')
-                
-    return pos_counts
+    return log_prob(trans)
 
 
-def laplace_emis_prob(training_tagged, pos): #Laplace version
-    '''Calculates the log of the emission probabilities
-    and applied Laplace add one smoothing'''
-    pos_counts = {p : {} for p in pos}
-    V = len(training_vocab) #Number of unique words in training corpus
-    
-    #Count number of each word for each POS
-    for (word, tag) in training_tagged:
-        if word not in pos_counts[tag]:
-            pos_counts[tag].update({word: 1})
-        else:
-            pos_counts[tag][word] += 1
-
-    #Count the total number of each POS
-    total_count = collections.Counter(pos_counts)
-    total_count = {tag:sum(total_count[tag].values()) for tag in pos}
-
-    for tag in pos_counts:
-        for word in pos_counts[tag]:
-            pos_counts[tag][word] = (pos_counts[tag][word] + 1)/(total_count[tag] + V)
-            #(Cw,j + 1) / (C_j + V) to calculate laplace probability,
-            #taking away some probability mass from seen items
-            if pos_counts[tag][word] != 0:
-                pos_counts[tag][word] = math.log2(pos_counts[tag][word]) 
-            else:
-                pos_counts[tag][word] = float('-inf')
+def count_emis(training_tagged, tag2idx, word2idx):
+    '''Counts each word for each POS, with an extra last column
+    for unknown words. Also returns the total count of each POS'''
+    emis = np.zeros((len(tag2idx), len(word2idx) + 1))
+    for (word, tag), count in Counter(training_tagged).items():
+        emis[tag2idx[tag], word2idx[word]] = count
+    return emis, emis.sum(axis=1)
 
-        #The amount of probability mass saved for unseen
-        #items for each respective POS
-        unseen_values = {tag:0 for tag in pos}
-        for tag in unseen_values:
-            unseen_values[tag] = 1/(total_count[tag] + V)
-                
-    return [pos_counts, unseen_values]
 
+def find_emis_prob(training_tagged, tag2idx, word2idx):
+    '''From the training data, calculates
+    the log of the emission probabilities.
+    The extra last column is for unknown words'''
+    #Count number of each word for each POS, and the total number of each POS
+    emis, total_count = count_emis(training_tagged, tag2idx, word2idx)
 
-init_prob = find_init_prob(training_sent_init, pos)
-trans_prob = find_trans_prob(training_tags, pos)
-emis_prob = find_emis_prob(training_tagged, pos)
+    emis /= total_count[:, None]
+    #Divide by total count for each emission to get the probability
 
-smoothed_emis_prob = laplace_emis_prob(training_tagged, pos)
-unseen_values = smoothed_emis_prob[1]
-smoothed_emis_prob = smoothed_emis_prob[0]
+    emis = log_prob(emis)
+    emis[:, -1] = 0
+    #For words not encountered during training, assign a probability of 1 to all states
+    return emis
 
 
+def laplace_emis_prob(training_tagged, tag2idx, word2idx): #Laplace version
+    '''Calculates the log of the emission probabilities
+    and applied Laplace add one smoothing.
+    The extra last column is for unknown words'''
+    V = len(word2idx) #Number of unique words in training corpus
+    #Count number of each word for each POS, and the total number of each POS
+    emis, total_count = count_emis(training_tagged, tag2idx, word2idx)
+
+    smoothed_total = total_count + V #C_j + V, computed once for each POS
+
+    emis = np.where(emis > 0, (emis + 1)/smoothed_total[:, None], 0)
+    #(Cw,j + 1) / (C_j + V) to calculate laplace probability,
+    #taking away some probability mass from seen items
+
+    #The amount of probability mass saved for unseen
+    #items for each respective POS, given to unknown words
+    unseen_values = 1/smoothed_total
+    emis[:, -1] = unseen_values
+
+    return log_prob(emis)
+
+
+def file_digest(filename):
+    '''SHA-1 of a file's contents, read in blocks'''
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+CACHE_VERSION = 1 #Increase whenever training changes, so older cache files are not reused
+
+@functools.lru_cache(maxsize=None)
+def train(training_file):
+    '''Trains the HMM on a tagged corpus. Returns the POS of each row,
+    the column of each word, and the init, trans, emis and smoothed emis
+    log probability tables. Cached for the rest of the process, and
+    on disk next to the corpus in training_file + '.hmm.npz', which is
+    only reused while the corpus has the same SHA-1 and the file has
+    the same CACHE_VERSION'''
+    digest = file_digest(training_file)
+    cache_file = training_file + '.hmm.npz'
+    try:
+        with np.load(cache_file) as cached:
+            if int(cached['version']) == CACHE_VERSION and str(cached['digest']) == digest:
+                word2idx = {sys.intern(w): i for i, w in enumerate(cached['words'].tolist())}
+                return (cached['tags'].tolist(), word2idx, cached['init_prob'],
+                        cached['trans_prob'], cached['emis_prob'], cached['smoothed_emis_prob'])
+    except Exception: #No cache yet, or a damaged one, so it is trained and saved again
+        pass
+
+    training_obs, training_tags, training_tagged, training_sent_init = process_train(training_file)
+    #eg: ['Sehr', 'gute', 'Beratung',], ['ADV', 'ADJ', 'NOUN'],
+    #[('Sehr', 'ADV'), ('gute', 'ADJ'), ('Beratung', 'NOUN')], and the sentence-initial tags
+
+    tag2idx = build_tag_index(set(training_tags))
+    tags = sorted(tag2idx, key=tag2idx.get) #POS of each row, eg: tags[tag2idx['NOUN']] == 'NOUN'
+    word2idx = build_vocab_index(training_obs)
+
+    init_prob = find_init_prob(training_sent_init, tag2idx)
+    trans_prob = find_trans_prob(training_tags, tag2idx)
+    emis_prob = find_emis_prob(training_tagged, tag2idx, word2idx)
+    smoothed_emis_prob = laplace_emis_prob(training_tagged, tag2idx, word2idx)
+
+    #Written to a temporary file first, so an interrupted run can't leave a partial cache
+    try:
+        fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(cache_file) or '.')
+    except OSError: #eg. a read-only directory, so just train again next time
+        return tags, word2idx, init_prob, trans_prob, emis_prob, smoothed_emis_prob
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, version=np.array(CACHE_VERSION), digest=np.array(digest),
+                                tags=np.array(tags), words=np.array(sorted(word2idx, key=word2idx.get)),
+                                init_prob=init_prob, trans_prob=trans_prob, emis_prob=emis_prob,
+                                smoothed_emis_prob=smoothed_emis_prob)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        os.remove(temp_file)
+
+    return tags, word2idx, init_prob, trans_prob, emis_prob, smoothed_emis_prob
+
+
+tags, word2idx, init_prob, trans_prob, emis_prob, smoothed_emis_prob = train(training_file)
 
-#Unknown word handling
-unknown_words = [w for w in test_vocab if w not in training_vocab]
-#Words that were not encountered during training
 
+###Module 3- Viterbi Tagging###
 
-def add_emis(emis_prob, unknown_words):
-    #For words with a probability of 0 for all states, assign a probability of 1 to all states
-    for word in unknown_words:
-        for j in pos:
-            emis_prob[j][word] = 0 
-    return emis_prob
 
-emis_prob = add_emis(emis_prob, unknown_words)
+def encode_obs(observations, word2idx):
+    '''Converts observations to their columns in the emission tables.
+    Words not encountered during training get the last, unknown column'''
+    unknown = len(word2idx)
+    return np.fromiter((word2idx.get(w, unknown) for w in observations),
+                       dtype=np.int64, count=len(observations))
 
-def laplace_add_emis(smoothed_emis_prob, unknown_words, unseen_values):
-    #For the smoothed emission probabilities
-    #For words with a probability of 0 for all states, assign a probability of 1 to all states
-    for word in unknown_words:
-        for j in pos:
-            smoothed_emis_prob[j][word] = unseen_values[j] 
-    return smoothed_emis_prob
 
-smoothed_emis_prob = laplace_add_emis(smoothed_emis_prob, unknown_words, unseen_values)
+def forward_numpy(init_prob, trans_prob, emis_cols, delta=None):
+    '''Initialization and recursion steps of the Viterbi algorithm,
+    updating all states at once with NumPy. Returns the viterbi
+    and backpointer tables. With a delta, only previous states within
+    delta of the best one are expanded (beam pruning)'''
+    T, N = emis_cols.shape
+    viterbi = np.empty((T, N))
+    backpointer = np.zeros((T, N), dtype=np.int32)
 
 
-###Module 3- Viterbi Tagging###
+    #Initialization, aka base case
+    viterbi[0] = init_prob + emis_cols[0]
 
 
-def nested_empty_dics(states, T):
-    dic = {t : empty_dic_none(states) for t in range(T)}
-    return dic
+    #Recursion step, aka inductive case
+    #All states j are updated at once from every previous state i
+    trans_t = np.ascontiguousarray(trans_prob.T) #trans_t[j, i], so the max over i is along rows
+    all_states = np.arange(N)
+    scores = np.empty((N, N)) #scores[j, i], reused at every time step
+    for t in range(1, T):
+        if delta is None:
+            np.add(viterbi[t-1], trans_t, out=scores)
+            backpointer[t] = scores.argmax(axis=1) #state i that had highest value
+            np.add(scores[all_states, backpointer[t]], emis_cols[t], out=viterbi[t])
+            #probability of word being in an impossible POS (eg. "cat" as 'DET') stays -inf
+        else:
+            live = np.flatnonzero(viterbi[t-1] >= viterbi[t-1].max() - delta)
+            live_scores = viterbi[t-1, live] + trans_t[:, live]
+            best = live_scores.argmax(axis=1)
+            backpointer[t] = live[best]
+            np.add(live_scores[all_states, best], emis_cols[t], out=viterbi[t])
+
+    return viterbi, backpointer
+
+
+def forward_loops(init_prob, trans_t, emis_cols, viterbi, backpointer, delta):
+    '''Same as forward_numpy, written as plain loops that fill in the
+    given viterbi and backpointer tables. trans_t is the transposed
+    transition table, so the inner loop over previous states reads it
+    contiguously. delta is np.inf for no pruning. Only fast once
+    compiled by numba (see forward_numba)'''
+    T, N = emis_cols.shape
+    for j in range(N):
+        viterbi[0, j] = init_prob[j] + emis_cols[0, j]
+
+    live = np.empty(N, dtype=np.int32)
+    for t in range(1, T):
+        threshold = viterbi[t-1].max() - delta
+        n_live = 0
+        for i in range(N):
+            if viterbi[t-1, i] >= threshold:
+                live[n_live] = i
+                n_live += 1
+        if n_live == 0: #eg. a negative or NaN delta, so fall back to all states
+            for i in range(N):
+                live[i] = i
+            n_live = N
+        for j in range(N):
+            arg = live[0]
+            best = viterbi[t-1, arg] + trans_t[j, arg]
+            for k in range(1, n_live):
+                i = live[k]
+                score = viterbi[t-1, i] + trans_t[j, i]
+                if score > best: #strictly greater, so ties go to the first state like argmax
+                    best = score
+                    arg = i
+            viterbi[t, j] = best + emis_cols[t, j]
+            backpointer[t, j] = arg
+
+
+QUANT_SCALE = 1000 #quantized steps per unit of log probability
+QUANT_IMPOSSIBLE = np.iinfo(np.int16).min #quantized log(0)
+SCORE_IMPOSSIBLE = np.iinfo(np.int32).min #log(0) in the quantized viterbi table
+MAX_QUANTIZED_STEPS = np.iinfo(np.int32).max // (2 * -(QUANT_IMPOSSIBLE + 1))
+#Each step adds at most two quantized terms of at least -32767, so longer inputs could
+#overflow int32. This is 2147483647 // 65534 == 32769, since 65534 * 32769 == 2147483646
+
+def quantize(table, scale=QUANT_SCALE):
+    '''Rounds a table of log probabilities to int16 steps of 1/scale.
+    -inf becomes QUANT_IMPOSSIBLE and everything else is clipped just
+    above it. Quantized tables are a quarter of the size, and only
+    change the prediction where two paths are within rounding of each other'''
+    info = np.iinfo(np.int16)
+    quantized = np.clip(np.rint(table * scale), info.min + 1, info.max)
+    quantized[np.isneginf(table)] = QUANT_IMPOSSIBLE
+    return quantized.astype(np.int16)
+
+
+def quantized_loops(init_prob, trans_t, emis_cols, viterbi, backpointer):
+    '''Same as forward_loops for tables made by quantize, with an int32
+    viterbi table, which only fits MAX_QUANTIZED_STEPS time steps.
+    Impossible steps are checked for explicitly, since there is
+    no -inf for integers'''
+    T, N = emis_cols.shape
+    for j in range(N):
+        if init_prob[j] == QUANT_IMPOSSIBLE or emis_cols[0, j] == QUANT_IMPOSSIBLE:
+            viterbi[0, j] = SCORE_IMPOSSIBLE
+        else:
+            viterbi[0, j] = np.int32(init_prob[j]) + np.int32(emis_cols[0, j])
 
+    for t in range(1, T):
+        for j in range(N):
+            best = SCORE_IMPOSSIBLE
+            arg = 0
+            for i in range(N):
+                if viterbi[t-1, i] == SCORE_IMPOSSIBLE or trans_t[j, i] == QUANT_IMPOSSIBLE:
+                    continue
+                score = viterbi[t-1, i] + np.int32(trans_t[j, i])
+                if score > best or best == SCORE_IMPOSSIBLE: #ties go to the first state
+                    best = score
+                    arg = i
+            if best == SCORE_IMPOSSIBLE or emis_cols[t, j] == QUANT_IMPOSSIBLE:
+                viterbi[t, j] = SCORE_IMPOSSIBLE
+            else:
+                viterbi[t, j] = best + np.int32(emis_cols[t, j])
+            backpointer[t, j] = arg
+
+
+compiled_kernels = {} #kernels compiled by numba, once they are first needed
+
+def compile_kernel(trans_prob):
+    '''Compiles the kernel for the type of trans_prob with numba the first
+    time it is needed: quantized_loops for int16, otherwise forward_loops.
+    nogil lets sentences be decoded in parallel threads'''
+    kernel = quantized_loops if trans_prob.dtype == np.int16 else forward_loops
+    if kernel not in compiled_kernels:
+        from numba import njit
+        compiled_kernels[kernel] = njit(cache=True, nogil=True)(kernel)
+    return compiled_kernels[kernel]
+
+
+def forward_numba(init_prob, trans_prob, emis_cols, delta=None):
+    '''Same as forward_numpy, using forward_loops compiled with numba.
+    Tables made by quantize are run with quantized_loops instead,
+    which has no pruning'''
+    T, N = emis_cols.shape
+    backpointer = np.zeros((T, N), dtype=np.int32)
+    trans_t = np.ascontiguousarray(trans_prob.T)
+    kernel = compile_kernel(trans_prob)
+    if trans_prob.dtype == np.int16:
+        if delta is not None:
+            raise ValueError("Beam pruning is not supported for quantized tables")
+        viterbi = np.empty((T, N), dtype=np.int32)
+        kernel(init_prob, trans_t, emis_cols, viterbi, backpointer)
+    else:
+        viterbi = np.empty((T, N))
+        kernel(init_prob, trans_t, emis_cols, viterbi, backpointer,
+               np.inf if delta is None else float(delta))
+    return viterbi, backpointer
+
+
+def max_plus(A, B):
+    '''Matrix product in the max-plus semiring, over the last two axes:
+    C[..., i, j] = max over k of A[..., i, k] + B[..., k, j]'''
+    return (A[..., :, :, None] + B[..., None, :, :]).max(axis=-2)
+
+
+def forward_scan(init_prob, trans_prob, emis_cols):
+    '''Same as forward_numpy, but without the loop over time steps.
+    Each step is the max-plus matrix M[t] = trans_prob + emis_cols[t], and
+    since max_plus is associative, all the prefix products M[1]...M[t] are
+    found by doubling in log2(T) rounds. Uses memory of order T*N**3,
+    so it is only meant for short sentences or small tag sets'''
+    T, N = emis_cols.shape
+    viterbi = np.empty((T, N))
+    backpointer = np.zeros((T, N), dtype=np.int32)
+    viterbi[0] = init_prob + emis_cols[0]
+
+    prefix = trans_prob[None, :, :] + emis_cols[1:, None, :] #M[1] to M[T-1]
+    shift = 1
+    while shift < T - 1:
+        prefix[shift:] = max_plus(prefix[:-shift], prefix[shift:])
+        shift *= 2
+
+    viterbi[1:] = (viterbi[0][None, :, None] + prefix).max(axis=1)
+    #The best previous states can then be found for all time steps at once
+    backpointer[1:] = (viterbi[:-1, :, None] + trans_prob).argmax(axis=1)
+    return viterbi, backpointer
+
+
+def forward_torch(init_prob, trans_prob, emis_cols, device=None, dtype=None):
+    '''Same as forward_numpy, with PyTorch on the GPU when there is one.
+    Computes in float32 by default; a smaller dtype such as
+    torch.bfloat16 halves memory traffic, but close scores
+    may then round to ties and pick a different state'''
+    import torch
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if dtype is None:
+        dtype = torch.float32
+    init_prob = torch.as_tensor(init_prob, device=device).to(dtype)
+    trans_prob = torch.as_tensor(trans_prob, device=device).to(dtype)
+    emis_cols = torch.as_tensor(emis_cols, device=device).to(dtype)
+    T, N = emis_cols.shape
+    viterbi = torch.empty((T, N), dtype=dtype, device=device)
+    backpointer = torch.zeros((T, N), dtype=torch.int32, device=device)
+
+    viterbi[0] = init_prob + emis_cols[0]
+    for t in range(1, T):
+        best, arg = (viterbi[t-1].unsqueeze(1) + trans_prob).max(dim=0)
+        viterbi[t] = best + emis_cols[t]
+        backpointer[t] = arg.to(torch.int32)
 
-def empty_dic_none(states):  ##Necessary to have again since None instead of 0
-    dic = {p : None for p in pos}
-    return dic
+    #Backtracking is done on the CPU
+    return viterbi.float().cpu().numpy(), backpointer.cpu().numpy()
 
 
-def viterbi_algorithm(observations, states, init_prob, trans_prob, emis_prob):
-    '''Efficiently predicts POS of words in a test set based on a HMM
-    using probabilities calculated from an annotated training corpus'''
-    N = len(states) #number of states
-    T = len(observations) #number of time steps
+def choose_backend(backend=None):
+    '''By default, use numba if it is installed, otherwise numpy'''
+    if backend is None:
+        try:
+            import numba
+            backend = "numba"
+        except ImportError:
+            backend = "numpy"
+    return backend
 
-    viterbi = nested_empty_dics(states, T)    
-    backpointer = [empty_dic(states) for t in range(T)]
 
+def viterbi_algorithm(obs_idx, tags, init_prob, trans_prob, emis_prob, backend=None, delta=None):
+    '''Efficiently predicts POS of words in a test set based on a HMM
+    using probabilities calculated from an annotated training corpus.
+    The observations are encoded by encode_obs and the probabilities
+    are arrays indexed like tags, or quantized by quantize (numba only).
+    backend is "numba", "numpy", "scan" or "torch", see choose_backend.
+    delta is a log probability margin for beam pruning, supported by
+    the numba and numpy backends'''
+    backend = choose_backend(backend)
+    forward = {"numba": forward_numba, "numpy": forward_numpy,
+               "scan": forward_scan, "torch": forward_torch}[backend]
+    quantized = [table.dtype == np.int16 for table in (init_prob, trans_prob, emis_prob)]
+    if any(quantized):
+        if not all(quantized):
+            raise ValueError("The init, trans and emis tables must all be quantized, or none of them")
+        if backend != "numba":
+            raise ValueError("Quantized tables need the numba backend")
+        if len(obs_idx) > MAX_QUANTIZED_STEPS:
+            raise ValueError("Quantized tables only fit %d time steps" % MAX_QUANTIZED_STEPS)
+    if delta is not None:
+        if not delta >= 0: #Also catches NaN
+            raise ValueError("delta must be a log probability margin >= 0, not %r" % delta)
+        if backend not in ("numba", "numpy"):
+            raise ValueError("Beam pruning is not supported by the %s backend" % backend)
+        forward = functools.partial(forward, delta=delta)
+
+    T = len(obs_idx) #number of time steps
+    if T == 0:
+        return []
+    emis_cols = np.ascontiguousarray(emis_prob[:, obs_idx].T)
+    #emis_cols[t] is the emission probability of observation t for every state
+
+    viterbi, backpointer = forward(init_prob, trans_prob, emis_cols)
 
-    #Initialization, aka base case
-    t = 0
-    for j in states:
-        current_obs = observations[t] #string of word at current time stamp
-        if current_obs in emis_prob[j]:
-            viterbi[t][j] = init_prob[j] + emis_prob[j][current_obs]
-        else:
-            viterbi[t][j] = float('-inf') 
 
-        backpointer[t][j] = "origin"
+    #Termination step
+    final_list = np.empty(T, dtype=np.int32) #Filled from last to first
+    final_list[T-1] = viterbi[T-1].argmax()
 
 
-    #Recursion step, aka inductive case
-    for t in range(1, T):
-        current_obs = observations[t]
-        for j in states:
-            if current_obs in emis_prob[j]:
-                options = []
-                for i in states:
-                    option = (viterbi[t-1][i] + trans_prob[i][j] + emis_prob[j][current_obs], i)
-                    options.append(option)
-                maximum = max(options) #tuple of (probability, observation string)
-                viterbi[t][j] = maximum[0] #max value
-                backpointer[t][j] = maximum[1] #POS that had highest value            
-            else: #probability of word being in an impossible POS (eg. "cat" as 'DET')
-                viterbi[t][j] = float('-inf')
+    #Backtracking step
+    for t in range(T-1, 0, -1):
+        final_list[t-1] = backpointer[t, final_list[t]]
 
+    return [tags[i] for i in final_list.tolist()]
 
-    #Termination step
-    last_round = viterbi[T-1]
-    #Turns it from dictionary into a list so max can be found
-    last_round = [(last_round[key], key) for key in last_round]
-    viterbi[T] = max(last_round)[0] #Adds final probability for reference
-    predicted_obs = max(last_round)[1]
 
+def tag_sentences(sents_idx, tags, init_prob, trans_prob, emis_prob,
+                  backend=None, n_jobs=1, delta=None):
+    '''Runs viterbi_algorithm on each encoded sentence separately, so no
+    path crosses a sentence boundary, and returns all predicted tags in
+    order. With n_jobs other than 1, sentences are decoded in a thread
+    pool (-1 uses all cores), which runs in parallel with numba'''
+    backend = choose_backend(backend)
+    def tag_one(obs_idx):
+        return viterbi_algorithm(obs_idx, tags, init_prob, trans_prob, emis_prob, backend, delta)
 
-    #Backtracking step
-    final_list = []
-    while predicted_obs != "origin":
-        final_list += [predicted_obs]
-        predicted_obs = backpointer[T-1][predicted_obs]
-        T -= 1
+    if n_jobs == 1:
+        sent_tags = [tag_one(obs_idx) for obs_idx in sents_idx]
+    else:
+        if backend == "numba":
+            #Tag one token first, so numba compiles the kernel before the threads start
+            for obs_idx in sents_idx:
+                if len(obs_idx):
+                    tag_one(obs_idx[:1])
+                    break
+        with ThreadPoolExecutor(os.cpu_count() if n_jobs == -1 else n_jobs) as executor:
+            sent_tags = list(executor.map(tag_one, sents_idx))
 
-    final_list = final_list[::-1] #Reverse order so it goes from first to last
-    return final_list
+    return [tag for sent in sent_tags for tag in sent]
 
 
 ###Module 4- Evaluation###
 
 
-new_tags = viterbi_algorithm(test_obs, pos, init_prob, trans_prob, emis_prob)
-
 def add_tags(test_file, tags, output_filename):
     '''Adds the predicted tags to the test text,
     formats it according to CoNLL, and saves the file'''
@@ -323,21 +581,23 @@ def add_tags(test_file, tags, output_filename):
 
     print(output_filename, "has been saved to your directory")
 
-test_file = 'de-test.t'
-output1 = "unsmoothed_tagged.tt"
-output2 = "smoothed_tagged.tt"
+if __name__ == "__main__":
+    test_file = 'de-test.t'
+    output1 = "unsmoothed_tagged.tt"
+    output2 = "smoothed_tagged.tt"
 
-#Viterbi without smoothing
-new_tags = viterbi_algorithm(test_obs, pos, init_prob, trans_prob, emis_prob)
-add_tags(test_file, new_tags, output1)
+    test_idx = [encode_obs(sent, word2idx) for sent in test_sents] #Shared by both runs
 
-#Viterbi with smoothing
-new_tags = viterbi_algorithm(test_obs, pos, init_prob, trans_prob, smoothed_emis_prob)
-add_tags(test_file, new_tags, output2)
+    #Viterbi without smoothing
+    new_tags = tag_sentences(test_idx, tags, init_prob, trans_prob, emis_prob)
+    add_tags(test_file, new_tags, output1)
 
-print(" ")
-print("In the commant terminal, go to the appropriate directory and enter:")
-print("python3 eval.py de-eval.tt", output1)
-print("and")
-print("python3 eval.py de-eval.tt", output2)
+    #Viterbi with smoothing
+    new_tags = tag_sentences(test_idx, tags, init_prob, trans_prob, smoothed_emis_prob)
+    add_tags(test_file, new_tags, output2)
 
+    print(" ")
+    print("In the commant terminal, go to the appropriate directory and enter:")
+    print("python3 eval.py de-eval.tt", output1)
+    print("and")
+    print("python3 eval.py de-eval.tt", output2)